@@ -1,10 +1,9 @@
 import os
 import csv
 import requests
-from io import BytesIO
-from PIL import Image
-from ultralytics import YOLO
+import pandas as pd
 from datetime import datetime, timedelta
+from detector import CAMERA_ID, get_camera_list, find_image_link, analyze
 
 # --- CONFIGURATION ---
 API_KEY = os.environ.get("LTA_API_KEY")
@@ -13,60 +12,23 @@ API_KEY = os.environ.get("LTA_API_KEY")
 SHIFT = 0.28
 TILT = 0.43
 
-def count_cars():
-    # 1. Fetch Image
-    url = "https://datamall2.mytransport.sg/ltaodataservice/Traffic-Imagesv2"
-    headers = {"AccountKey": API_KEY, "accept": "application/json"}
+# One keep-alive session for both LTA calls
+HTTP_TIMEOUT = 10  # seconds
+session = requests.Session()
+session.headers.update({"accept": "application/json"})
 
+def count_cars():
     try:
-        resp = requests.get(url, headers=headers).json()
-        target_link = None
-        for img in resp['value']:
-            if str(img['CameraID']) == "2701":
-                target_link = img['ImageLink']
-                break
-
+        # 1. Fetch Image
+        resp = get_camera_list(session, API_KEY, timeout=HTTP_TIMEOUT)
+        target_link = find_image_link(resp.content)
         if not target_link:
-            print("Error: Camera 2701 not found")
+            print(f"Error: Camera {CAMERA_ID} not found")
             return None, None
+        img_resp = session.get(target_link, timeout=HTTP_TIMEOUT)
 
-        # 2. Analyze Image
-        img_resp = requests.get(target_link)
-        img = Image.open(BytesIO(img_resp.content))
-
-        model = YOLO('yolov8m.pt')
-        results = model(img, imgsz=1024, conf=0.15, iou=0.6, classes=[2, 3, 5, 7])[0]
-
-        # 3. Math Logic
-        width, height = img.size
-        base_top = width * 0.60
-        base_bottom = width * 0.40
-        top_x = base_top + (width * SHIFT) + (width * TILT)
-        bottom_x = base_bottom + (width * SHIFT) - (width * TILT)
-        slope = (bottom_x - top_x) / height
-
-        to_johor = 0
-        to_woodlands = 0
-
-        for box in results.boxes:
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            center_x = (x1 + x2) / 2
-            center_y = (y1 + y2) / 2
-            box_w = x2 - x1
-            box_h = y2 - y1
-
-            # Filters (Billboard & Zone)
-            if center_y > (height * 0.60) and center_x < (width * 0.30): continue
-            if (box_w / box_h) > 3.0: continue
-
-            # Counting
-            divider_x = top_x + (slope * center_y)
-            if center_x < divider_x:
-                to_johor += 1
-            else:
-                to_woodlands += 1
-
-        return to_johor, to_woodlands
+        # 2. Analyze Image (detection, filters and counting live in detector.py)
+        return analyze(img_resp.content, SHIFT, TILT)
 
     except Exception as e:
         print(f"Error: {e}")
@@ -83,3 +45,8 @@ if __name__ == "__main__":
         with open("data.csv", "a", newline="") as f:
             writer = csv.writer(f)
             writer.writerow([sg_time, j, w])
+
+        # Rolling 24h snapshot for the dashboard (Parquet keeps the dates typed)
+        df = pd.read_csv("data.csv", parse_dates=['Time'])
+        df = df[df['Time'] > df['Time'].max() - timedelta(hours=24)]
+        df.to_parquet("data_recent.parquet", index=False)
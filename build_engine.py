@@ -0,0 +1,47 @@
+import argparse
+from ultralytics import YOLO
+
+# --- ENGINE BUILDER ---
+# Run this once on the machine that will host the dashboard. detector.py picks the
+# result up automatically and fall back to yolov8n.pt when it isn't usable:
+#   - yolov8n.engine (TensorRT, needs CUDA) is used when a GPU is available
+#   - on CPU-only hosts like Streamlit Cloud, an OpenVINO model folder
+#     (yolov8n_int8_openvino_model/ or yolov8n_openvino_model/) wins over yolov8n.onnx
+#
+#   python build_engine.py                                            -> FP16 TensorRT engine
+#   python build_engine.py --int8 --data calib.yaml                   -> INT8 TensorRT engine
+#   python build_engine.py --format openvino --int8 --data calib.yaml -> INT8 OpenVINO for CPU
+#   python build_engine.py --format onnx                              -> FP32 ONNX for CPU
+#
+# For INT8, calib.yaml is a coco-style dataset file whose images are a few hundred
+# saved frames from camera 2701 (the same kind of snapshots the bot analyzes).
+# Exports have a fixed input size, so the apps always run them at 640.
+
+parser = argparse.ArgumentParser(description="Export YOLOv8 to TensorRT, OpenVINO or ONNX")
+parser.add_argument("--weights", default="yolov8n.pt")
+parser.add_argument("--format", choices=["engine", "openvino", "onnx"], default="engine")
+parser.add_argument("--imgsz", type=int, default=640)
+parser.add_argument("--int8", action="store_true", help="INT8 weights (engine/openvino, needs --data)")
+parser.add_argument("--data", default=None, help="Calibration dataset yaml for INT8")
+args = parser.parse_args()
+
+if args.int8 and not args.data:
+    parser.error("--int8 needs --data pointing at a calibration dataset")
+
+model = YOLO(args.weights)
+if args.format == "engine":
+    path = model.export(
+        format="engine",
+        imgsz=args.imgsz,
+        half=not args.int8,
+        int8=args.int8,
+        data=args.data,
+        simplify=True,
+        dynamic=False,
+        workspace=4,
+    )
+elif args.format == "openvino":
+    path = model.export(format="openvino", imgsz=args.imgsz, int8=args.int8, data=args.data)
+else:
+    path = model.export(format="onnx", imgsz=args.imgsz, half=False, dynamic=False, simplify=True)
+print(f"Model saved to {path}")
@@ -0,0 +1,242 @@
+import os
+import re
+import threading
+import functools
+import numpy as np
+import cv2
+import torch
+from PIL import Image
+from io import BytesIO
+# orjson parses the LTA camera list 2-3x faster than the stdlib; same result either way
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+# Everything both bot.py (CLI) and traffic.py (dashboard) need to turn a camera frame
+# into Johor / Woodlands counts, so the optimizations only live in one place.
+
+# --- CONFIGURATION ---
+LTA_URL = "https://datamall2.mytransport.sg/ltaodataservice/Traffic-Imagesv2"
+CAMERA_ID = "2701"
+
+# --- MODEL ---
+# Nano model is plenty for the small LTA frames (swap to yolov8s if recall drops).
+# Fastest one we have (see build_engine.py): TensorRT engine on a GPU, then OpenVINO
+# (INT8 first - VNNI kernels on modern x86) or ONNX Runtime on CPU-only hosts,
+# plain PyTorch otherwise
+if os.path.exists('yolov8n.engine') and torch.cuda.is_available():
+    MODEL_PATH = 'yolov8n.engine'
+elif os.path.isdir('yolov8n_int8_openvino_model'):
+    MODEL_PATH = 'yolov8n_int8_openvino_model'
+elif os.path.isdir('yolov8n_openvino_model'):
+    MODEL_PATH = 'yolov8n_openvino_model'
+elif os.path.exists('yolov8n.onnx'):
+    MODEL_PATH = 'yolov8n.onnx'
+else:
+    MODEL_PATH = 'yolov8n.pt'
+# Exported models are built for one fixed input size
+FIXED_IMGSZ = not MODEL_PATH.endswith('.pt')
+
+# Use every core for CPU inference; on a GPU let cuDNN pick the fastest conv kernels
+# for our (nearly always identical) input shape
+torch.set_num_threads(os.cpu_count() or 1)
+if torch.cuda.is_available():
+    torch.backends.cudnn.benchmark = True
+# FP16 only helps on the GPU, and only PyTorch and TensorRT take it - the ONNX and
+# OpenVINO exports are FP32 and reject a float16 input
+HALF = torch.cuda.is_available() and MODEL_PATH.endswith(('.pt', '.engine'))
+
+# The model is shared by every caller (dashboard sessions run in threads),
+# so only one of them may run it at a time
+model_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def load_model():
+    # Loaded on first use, once per process. Ultralytics is imported here too: it is
+    # a heavy import and nothing else in this module needs it.
+    from ultralytics import YOLO
+    return YOLO(MODEL_PATH, task='detect')
+
+def pick_imgsz(img):
+    # LTA frames are ~320x240, so don't letterbox them up past their own size.
+    # Exported models are built for one fixed input, so they always get 640.
+    if FIXED_IMGSZ: return 640
+    return min(640, max(320, (max(img.shape[:2]) + 31) // 32 * 32))
+
+# --- JPEG DECODER (libjpeg-turbo if installed, OpenCV/PIL otherwise) ---
+@functools.lru_cache(maxsize=None)
+def jpeg_decoder():
+    try:
+        return TurboJPEG()
+    except Exception:  # package or native libturbojpeg missing
+        return None
+
+def decode_jpeg(img_bytes, rgb=False):
+    # BGR is what YOLO expects for NumPy input; RGB is for drawing and st.image
+    tj = jpeg_decoder()
+    if tj is not None:
+        return tj.decode(img_bytes, pixel_format=TJPF_RGB if rgb else TJPF_BGR)
+    if rgb:
+        return np.asarray(Image.open(BytesIO(img_bytes)).convert('RGB'))
+    return cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+# --- LTA FEED ---
+# Ask LTA for just our cameras with an OData $filter. If the endpoint rejects the query
+# (a 4xx that isn't about the key or rate limiting) we stop sending it for the rest of
+# the process. Anything else - including a 5xx, a 429 or a camera that's briefly
+# missing from the feed - goes back to the caller as is, without a second request.
+use_odata_filter = True
+
+def get_camera_list(session, api_key, camera_ids=(CAMERA_ID,), timeout=10):
+    global use_odata_filter
+    headers = {"AccountKey": api_key}
+    if use_odata_filter:
+        query = " or ".join(f"CameraID eq '{cam}'" for cam in camera_ids)
+        resp = session.get(LTA_URL, headers=headers, params={"$filter": query}, timeout=timeout)
+        if not 400 <= resp.status_code < 500 or resp.status_code in (401, 403, 429):
+            return resp
+        use_odata_filter = False
+    return session.get(LTA_URL, headers=headers, timeout=timeout)
+
+def find_image_link(buf, camera_id=CAMERA_ID):
+    # The camera list has hundreds of records and we only want a few, so look for them
+    # in the raw bytes and only decode the ImageLink next to each
+    i = buf.find(b'"CameraID":"' + camera_id.encode() + b'"')
+    if i != -1:
+        record = buf[buf.rfind(b'{', 0, i):buf.find(b'}', i)]
+        m = re.search(rb'"ImageLink"\s*:\s*("(?:[^"\\]|\\.)*")', record)
+        if m: return json_loads(m.group(1))
+
+    # Unexpected layout - fall back to parsing the whole thing
+    for img in json_loads(buf)['value']:
+        if str(img['CameraID']) == camera_id:
+            return img['ImageLink']
+    return None
+
+# --- DETECTION ---
+# Letterbox input buffers, reused between calls (only touched under model_lock)
+input_buffers = {}
+
+def letterbox_batch(frames):
+    # Letterbox every BGR frame with cv2 (SIMD resize) straight into one reused
+    # (B, 3, H, W) RGB float tensor, instead of Ultralytics' per-frame Python
+    # preprocessing. Returns the tensor and each frame's (scale, pad_x, pad_y).
+    imgsz = max(pick_imgsz(f) for f in frames)
+    scales = [imgsz / max(f.shape[:2]) for f in frames]
+    if FIXED_IMGSZ:
+        h = w = imgsz
+    else:
+        # Only pad up to the next multiple of 32, like Ultralytics does for .pt models
+        h = max((round(f.shape[0] * s) + 31) // 32 * 32 for f, s in zip(frames, scales))
+        w = max((round(f.shape[1] * s) + 31) // 32 * 32 for f, s in zip(frames, scales))
+
+    batch = input_buffers.get((len(frames), h, w))
+    if batch is None:
+        batch = input_buffers[(len(frames), h, w)] = torch.empty((len(frames), 3, h, w))
+    batch.fill_(114 / 255)  # Ultralytics' grey padding
+
+    offsets = []
+    for i, (frame, scale) in enumerate(zip(frames, scales)):
+        nh, nw = round(frame.shape[0] * scale), round(frame.shape[1] * scale)
+        top, left = (h - nh) // 2, (w - nw) // 2
+        rgb = cv2.cvtColor(cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR), cv2.COLOR_BGR2RGB)
+        batch[i, :, top:top + nh, left:left + nw].copy_(torch.from_numpy(rgb).permute(2, 0, 1)).div_(255)
+        offsets.append((scale, left, top))
+    return batch, offsets
+
+def detect(frames, model=None):
+    # One batched forward pass over every BGR frame instead of one call per camera.
+    # Exported models are built for batch 1 (build_engine.py), so they get one frame
+    # per pass instead. Returns one (N, 6) array per frame: x1, y1, x2, y2, conf, cls
+    if model is None:
+        model = load_model()
+    chunks = [[frame] for frame in frames] if FIXED_IMGSZ else [frames]
+    results, offsets = [], []
+    with model_lock, torch.inference_mode():
+        for chunk in chunks:
+            batch, chunk_offsets = letterbox_batch(chunk)
+            results += model(batch, imgsz=tuple(batch.shape[2:]), conf=0.15, iou=0.6,
+                             classes=[2, 3, 5, 7], half=HALF, verbose=False)
+            offsets += chunk_offsets
+
+    # Boxes come back in letterboxed coordinates; map them onto the original frame and
+    # clip them to it (as Ultralytics does), so boxes reaching into the padding don't
+    # get their centers shifted. Filters (Billboard & Zone) then run on the torch
+    # tensor - still on the GPU if we have one - so only the boxes we count get copied back
+    boxes = []
+    for frame, result, (scale, pad_x, pad_y) in zip(frames, results, offsets):
+        height, width = frame.shape[:2]
+        det = result.boxes.data
+        pad = det.new_tensor([pad_x, pad_y, pad_x, pad_y])
+        det = torch.cat([(det[:, :4] - pad) / scale, det[:, 4:]], dim=1)
+        det[:, [0, 2]] = det[:, [0, 2]].clamp(0, width)
+        det[:, [1, 3]] = det[:, [1, 3]].clamp(0, height)
+        cx = (det[:, 0] + det[:, 2]) * 0.5
+        cy = (det[:, 1] + det[:, 3]) * 0.5
+        box_w = det[:, 2] - det[:, 0]
+        box_h = det[:, 3] - det[:, 1]
+        keep = ~((cy > height * 0.60) & (cx < width * 0.30)) & ((box_w / box_h) <= 3.0)
+        boxes.append(det[keep].cpu().numpy())
+    return boxes
+
+# --- COUNTING ---
+@functools.lru_cache(maxsize=64)
+def divider_geometry(width, height, shift, tilt):
+    # Divider line for the calibration values (0.01 slider steps, so the cache hits often)
+    base_top = width * 0.60
+    base_bottom = width * 0.40
+    top_x = base_top + (width * shift) + (width * tilt)
+    bottom_x = base_bottom + (width * shift) - (width * tilt)
+    return top_x, bottom_x, (bottom_x - top_x) / height
+
+# Returns (left, to_johor): the Johor-bound mask and how many boxes it marks.
+# With Numba installed it's a compiled loop that counts in the same pass as the mask;
+# otherwise the same thing in vectorized NumPy.
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def split_by_divider(boxes, top_x, slope):
+        left = np.empty(boxes.shape[0], np.bool_)
+        to_johor = 0
+        for i in range(boxes.shape[0]):
+            cx = (boxes[i, 0] + boxes[i, 2]) * 0.5
+            cy = (boxes[i, 1] + boxes[i, 3]) * 0.5
+            left[i] = cx < top_x + slope * cy
+            if left[i]:
+                to_johor += 1
+        return left, to_johor
+else:
+    def split_by_divider(boxes, top_x, slope):
+        cx = (boxes[:, 0] + boxes[:, 2]) * 0.5
+        cy = (boxes[:, 1] + boxes[:, 3]) * 0.5
+        left = cx < (top_x + slope * cy)
+        return left, int(np.count_nonzero(left))
+
+def warm_up(model=None):
+    # Compile the kernel (same array layout as boxes[:, :4]) and run one dummy frame
+    # through the model, so TensorRT context setup / cuDNN autotuning happen now
+    # instead of on the first real call
+    split_by_divider(np.zeros((1, 6), np.float32)[:, :4], 0.0, 0.0)
+    detect([np.zeros((240, 320, 3), np.uint8)], model)
+
+def count_sides(boxes, width, height, shift, tilt):
+    # Returns (to_johor, to_woodlands, left) where left marks the Johor-bound boxes
+    top_x, _, slope = divider_geometry(width, height, shift, tilt)
+    left, to_johor = split_by_divider(boxes[:, :4], top_x, slope)
+    return to_johor, len(left) - to_johor, left
+
+def analyze(img, shift, tilt):
+    # img is the camera JPEG (bytes) or an already decoded BGR array
+    if isinstance(img, bytes):
+        img = decode_jpeg(img)
+    height, width = img.shape[:2]
+    to_johor, to_woodlands, _ = count_sides(detect([img])[0], width, height, shift, tilt)
+    return to_johor, to_woodlands
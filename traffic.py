@@ -1,24 +1,44 @@
+import time
+import logging
+import threading
 import streamlit as st
 import requests
-from PIL import Image, ImageDraw
-from io import BytesIO
-from ultralytics import YOLO
+import numpy as np
+import cv2
 import pandas as pd
+from io import BytesIO
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import detector
+from detector import CAMERA_ID, decode_jpeg, get_camera_list, find_image_link
+
+log = logging.getLogger("jamsniper")
 
 # --- CONFIGURATION ---
+# SHARED_KEY: the app's own key from Secrets. A key a user typed in stays in their
+# session and is never handed to the background poller (which serves everyone).
 if "LTA_API_KEY" in st.session_state:
     API_KEY = st.session_state["LTA_API_KEY"]
+    SHARED_KEY = False
 elif "LTA_API_KEY" in st.secrets:
     API_KEY = st.secrets["LTA_API_KEY"]
+    SHARED_KEY = True
 else:
     st.error("API Key missing! Please add it in Secrets.")
     st.stop()
 
 # ⚠️ YOUR DATABASE LINK
 CSV_URL = "https://github.com/shimeichan88/Jamsniper/raw/refs/heads/main/data.csv"
+# Last 24h only, written by bot.py next to the CSV (smaller, and dates are already typed)
+PARQUET_URL = "https://github.com/shimeichan88/Jamsniper/raw/refs/heads/main/data_recent.parquet"
 
-model = YOLO('yolov8m.pt') 
+# --- MODEL (loaded once per process, not on every rerun) ---
+@st.cache_resource(show_spinner=False)
+def get_model():
+    # Load YOLO and warm it (and the counting kernel) up before the first Refresh click
+    model = detector.load_model()
+    detector.warm_up(model)
+    return model
 
 # --- SESSION STATE ---
 if 'traffic_data' not in st.session_state:
@@ -28,92 +48,238 @@ if 'traffic_data' not in st.session_state:
 @st.cache_data(ttl=300)
 def load_history():
     try:
-        # 1. Download CSV
-        df = pd.read_csv(CSV_URL)
-        
-        # 2. Convert to DateTime objects (so we can sort/filter)
-        df['Time'] = pd.to_datetime(df['Time'])
+        # 1. Download the 24h snapshot (fall back to the full CSV if it isn't there yet)
+        # Either way 'Time' arrives as DateTime objects (so we can sort/filter)
+        # Downloaded through the shared keep-alive session (with a timeout) rather than pandas' own urllib
+        resp = http().get(PARQUET_URL, timeout=HTTP_TIMEOUT)
+        if resp.status_code == 200:
+            df = pd.read_parquet(BytesIO(resp.content))
+        else:
+            resp = http().get(CSV_URL, timeout=HTTP_TIMEOUT)
+            df = pd.read_csv(BytesIO(resp.content), parse_dates=['Time'])
         
-        # 3. Filter: Keep only last 24 hours
+        # 2. Filter: Keep only last 24 hours
         cutoff_time = datetime.now() - timedelta(hours=24)
         df_recent = df[df['Time'] > cutoff_time].copy()
         
-        # 4. FORCE 24-HOUR FORMAT (The Fix)
+        # 3. FORCE 24-HOUR FORMAT (The Fix)
         # We convert the time to a string like "22:48" so the chart doesn't mess it up
         df_recent['Time'] = df_recent['Time'].dt.strftime('%H:%M')
         
-        # 5. Return with Time as the Index
+        # 4. Return with Time as the Index
         return df_recent.set_index('Time')
     except Exception:
         return pd.DataFrame()
 
+# --- HTTP (one keep-alive session, so refreshes reuse the TLS connection) ---
+HTTP_TIMEOUT = 5  # seconds - never let a slow LTA call hang the worker
+
+@st.cache_resource
+def http():
+    session = requests.Session()
+    session.headers.update({"accept": "application/json"})
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def http_pool():
+    return ThreadPoolExecutor(max_workers=4)
+
 # --- AI ANALYZER ---
-def fetch_and_analyze():
-    url = "https://datamall2.mytransport.sg/ltaodataservice/Traffic-Imagesv2"
-    headers = {"AccountKey": API_KEY, "accept": "application/json"}
-    try:
-        response = requests.get(url, headers=headers)
-        target_link = None
-        if response.status_code == 200:
-            for img in response.json()['value']:
-                if str(img['CameraID']) == "2701":
-                    target_link = img['ImageLink']
-                    break
-        if not target_link: return None
-        
-        img_resp = requests.get(target_link)
-        img = Image.open(BytesIO(img_resp.content))
-        
-        results = model(img, imgsz=1024, conf=0.15, iou=0.6, classes=[2, 3, 5, 7])
-        return {"image": img, "results": results[0]}
-    except Exception as e:
-        st.error(f"Error: {e}")
-        return None
+# Cameras to analyze; the dashboard (and its calibration) is for the first one.
+# With yolov8n.pt their frames go through YOLO in one batch. Exported models are
+# batch 1, so detector.detect() runs those one frame at a time.
+CAMERA_IDS = [CAMERA_ID]
+
+class CameraOffline(Exception):
+    pass  # the dashboard camera isn't in LTA's feed right now
+
+def get_image(session, link, previous=None):
+    # Conditional GET: if the camera hasn't published a new frame since `previous`,
+    # the server answers 304 with no body and we reuse the bytes we already have
+    # (which then also hit run_yolo's cache)
+    headers = {}
+    if previous and previous['link'] == link and previous['last_modified']:
+        headers['If-Modified-Since'] = previous['last_modified']
+    resp = session.get(link, headers=headers, timeout=HTTP_TIMEOUT)
+    if resp.status_code == 304:
+        return previous
+    resp.raise_for_status()  # don't keep an error page as the frame to revalidate against
+    return {"link": link, "last_modified": resp.headers.get('Last-Modified'), "content": resp.content}
+
+def download_frames(session, pool, api_key, last_images):
+    # Camera list + one conditional download per camera, shared by Refresh clicks and the
+    # background poller. Takes and returns {cam: get_image result}; cameras missing
+    # from the feed are missing from the result. A failed camera list raises.
+    
+    # The links are usually the same as last time, so start downloading them while
+    # the camera list loads instead of waiting for one round trip after the other
+    speculative = {cam: pool.submit(get_image, session, prev['link'], prev)
+                   for cam, prev in last_images.items()}
+    
+    response = get_camera_list(session, api_key, CAMERA_IDS, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    links = {cam: find_image_link(response.content, cam) for cam in CAMERA_IDS}
+    
+    downloads = {}
+    for cam, link in links.items():
+        if not link: continue
+        if cam in speculative and link == last_images[cam]['link']:
+            downloads[cam] = speculative[cam]
+        else:
+            downloads[cam] = pool.submit(get_image, session, link, last_images.get(cam))
+    return {cam: download.result() for cam, download in downloads.items()}
+
+@st.cache_resource(show_spinner=False)
+def last_frames():
+    # Last download per camera for the Secrets key. Lives with the process, not the
+    # session, because it's used under fetch_and_analyze's shared cache.
+    return {}
+
+def fetch_image_bytes(api_key, shared):
+    # Returns one JPEG per entry of CAMERA_IDS (None for cameras missing from the feed).
+    # Only the Secrets key remembers its last frames; a user's own key starts cold each
+    # time rather than keeping JPEGs around for every key anyone ever typed in.
+    store = last_frames()
+    images = download_frames(http(), http_pool(), api_key, store.get('images', {}) if shared else {})
+    if shared: store['images'] = images  # swapped whole, sessions may be reading the old one
+    return tuple(images[cam]['content'] if cam in images else None for cam in CAMERA_IDS)
+
+# Keyed by the image bytes, so YOLO only runs on new frames even after the minute is up
+@st.cache_data(ttl=60, show_spinner=False)
+def run_yolo(images):
+    # Plain NumPy boxes are cheap to cache and keep torch objects out of session state
+    return detector.detect([decode_jpeg(img_bytes) for img_bytes in images], get_model())
+
+# --- BACKGROUND PREFETCH ---
+# While the app is in use, one thread per process polls LTA (with the Secrets key only)
+# and analyzes new frames, so a Refresh click usually finds a fresh result waiting
+# instead of doing both round trips + YOLO.
+PREFETCH_INTERVAL = 30  # seconds
+PREFETCH_IDLE = 300     # stop polling once no session has run for this long
+
+@st.cache_resource(show_spinner=False)
+def prefetcher():
+    # State shared between the sessions and the polling thread
+    return {"lock": threading.Lock(), "thread": None, "wanted": 0.0}
+
+def poll(state, session, pool, model, api_key):
+    # The thread has no Streamlit script context, so everything it needs is handed over.
+    # It exits once nobody has wanted a result for PREFETCH_IDLE - that includes a thread
+    # left behind by clearing the cache, whose state nobody touches any more.
+    frames = {}  # last download per camera, for conditional GETs
+    while time.time() - state['wanted'] < PREFETCH_IDLE:
+        try:
+            frames = download_frames(session, pool, api_key, frames)
+            if CAMERA_IDS[0] in frames:
+                images = [frames[cam]['content'] for cam in CAMERA_IDS if cam in frames]
+                result = state.get('result')
+                fresh = result is not None and result['image_bytes'] == images[0]
+                # New frame: analyze it, unless a Refresh click is using the model right now
+                if not fresh and not detector.model_lock.locked():
+                    boxes = detector.detect([decode_jpeg(img_bytes) for img_bytes in images], model)
+                    state['result'] = {"image_bytes": images[0], "boxes": boxes[0]}
+                    fresh = True
+                if fresh: state['time'] = time.time()
+        except Exception:
+            # Try again next round; a Refresh click still fetches live
+            log.warning("Background prefetch failed", exc_info=True)
+        time.sleep(PREFETCH_INTERVAL)
+
+def start_prefetch(api_key):
+    # Called on every run of a session using the Secrets key: marks the app as in use and
+    # (re)starts the poller if it isn't running
+    state = prefetcher()
+    state['wanted'] = time.time()
+    with state['lock']:
+        if state['thread'] is None or not state['thread'].is_alive():
+            state['api_key'] = api_key
+            state['thread'] = threading.Thread(
+                target=poll, args=(state, http(), http_pool(), get_model(), api_key),
+                name="jamsniper-prefetch", daemon=True)
+            state['thread'].start()
+
+# Clicks within a minute replay the last result without touching the network or YOLO.
+# Keyed by the API key, so sessions with their own key never share a fetch.
+# shared: api_key is the app's Secrets key.
+# Only plain bytes + NumPy are cached; errors (an offline camera too) raise and aren't cached.
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_and_analyze(api_key, shared):
+    # Use the background result if it's from the last poll or the one before
+    # (and was fetched with the same key)
+    state = prefetcher()
+    result = state.get('result')
+    if (result is not None and state.get('api_key') == api_key
+            and time.time() - state.get('time', 0) < PREFETCH_INTERVAL * 2):
+        # A copy: on a cache miss this exact dict ends up in the session, where
+        # draw_interface keeps its renders - the poller's own must stay clean
+        return dict(result)
+    
+    images = fetch_image_bytes(api_key, shared)
+    if images[0] is None: raise CameraOffline(f"Camera {CAMERA_ID} not in the feed")
+    
+    # Frames come back in CAMERA_IDS order, so the dashboard camera's boxes are first
+    boxes = run_yolo(tuple(img_bytes for img_bytes in images if img_bytes is not None))
+    return {"image_bytes": images[0], "boxes": boxes[0]}
 
 # --- VISUALIZER ---
+# Each render is a full frame copy kept in the session, so only the last few
+RENDER_CACHE_SIZE = 4
+
+# RGB, to match the decoded frame
+YELLOW = (255, 255, 0)
+GREEN = (0, 255, 0)  # To Johor
+RED = (255, 0, 0)    # To Woodlands
+
 def draw_interface(data, shift, tilt):
-    img = data['image'].copy() 
-    results = data['results']
-    width, height = img.size
-    draw = ImageDraw.Draw(img)
+    # Sliders dragged back to a position we've already drawn cost nothing
+    renders = data.setdefault('renders', {})
+    if (shift, tilt) in renders:
+        return renders[(shift, tilt)]
+    
+    # Slider-independent prep happens on the first draw only: the RGB frame, and every
+    # box as a closed 4-point int outline (N, 4, 2) ready for cv2.polylines
+    if 'image' not in data:
+        data['image'] = decode_jpeg(data['image_bytes'], rgb=True)
+        x1, y1, x2, y2 = data['boxes'][:, :4].astype(np.int32).T
+        data['outlines'] = np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1).reshape(-1, 4, 2)
+    
+    # OpenCV draws straight into a NumPy copy of the frame.
+    # Once the render cache is full, the evicted render's buffer is reused as the canvas
+    # instead of allocating a new one.
+    if len(renders) >= RENDER_CACHE_SIZE:
+        img = renders.pop(next(iter(renders)))[0]
+        np.copyto(img, data['image'])
+    else:
+        img = data['image'].copy()
+    boxes = data['boxes']
+    height, width = img.shape[:2]
     
     # Calibration Logic
-    base_top = width * 0.60
-    base_bottom = width * 0.40
-    top_x = base_top + (width * shift) + (width * tilt)
-    bottom_x = base_bottom + (width * shift) - (width * tilt)
-    draw.line([(top_x, 0), (bottom_x, height)], fill="yellow", width=5)
+    top_x, bottom_x, _ = detector.divider_geometry(width, height, shift, tilt)
+    cv2.line(img, (int(top_x), 0), (int(bottom_x), height), YELLOW, 5)
     
-    to_johor = 0
-    to_woodlands = 0
-    slope = (bottom_x - top_x) / height
+    # Count Logic (boxes were already filtered by the detector)
+    to_johor, to_woodlands, left = detector.count_sides(boxes, width, height, shift, tilt)
     
-    for box in results.boxes:
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        center_x = (x1 + x2) / 2
-        center_y = (y1 + y2) / 2
-        box_w = x2 - x1
-        box_h = y2 - y1
-        
-        # Filters
-        if center_y > (height * 0.60) and center_x < (width * 0.30): continue 
-        if (box_w / box_h) > 3.0: continue
-
-        # Count Logic
-        divider_x = top_x + (slope * center_y)
-        if center_x < divider_x:
-            to_johor += 1
-            color = "#00ff00"
-        else:
-            to_woodlands += 1
-            color = "#ff0000"
-            
-        draw.rectangle([x1, y1, x2, y2], outline=color, width=2)
-            
+    # One polylines call per color group instead of one rectangle call per box
+    outlines = data['outlines']
+    for group, color in ((outlines[left], GREEN), (outlines[~left], RED)):
+        if len(group):
+            cv2.polylines(img, list(group), True, color, 2)
+    
+    renders[(shift, tilt)] = (img, to_johor, to_woodlands)
     return img, to_johor, to_woodlands
 
 # --- WEBSITE LAYOUT ---
 st.set_page_config(layout="wide", page_title="JamSniper Pro")
+
+# After set_page_config: on a cold start these emit Streamlit elements of their own
+get_model()
+if SHARED_KEY:
+    start_prefetch(API_KEY)
+
 st.title("🚦 JamSniper: Live Dashboard")
 
 st.sidebar.header("Calibration")
@@ -123,11 +289,12 @@ st.sidebar.divider()
 
 if st.sidebar.button("📸 Refresh Feed", type="primary"):
     with st.spinner("Analyzing..."):
-        data = fetch_and_analyze()
-        if data:
-            st.session_state['traffic_data'] = data
-        else:
+        try:
+            st.session_state['traffic_data'] = fetch_and_analyze(API_KEY, SHARED_KEY)
+        except CameraOffline:
             st.error("Camera Offline")
+        except Exception as e:
+            st.error(f"Error: {e}")
 
 if st.session_state['traffic_data']:
     processed_img, count_johor, count_woodlands = draw_interface(st.session_state['traffic_data'], shift_val, tilt_val)